@@ -0,0 +1,166 @@
+"""
+Checks the timing rules of the gesture engine in interface_telnet.NuimoController by feeding raw
+events at fixed timestamps, the way run_interface does: poll_timers() first, then consume_raw_event().
+Needs neither a Nuimo nor VLC.
+
+ e.g. python gesture-test.py
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+from interface_telnet import MediaPlayerController, NuimoController, NuimoVLCController, RawNuimoEvent
+
+
+class RecordingPlayerController(MediaPlayerController):
+    """
+    A media player which only records the commands it receives.
+    """
+    def __init__(self):
+        self.commands = []
+        self.volume = 50.0
+        super(RecordingPlayerController, self).__init__()
+
+    def play(self):
+        self.commands.append('play')
+
+    def stop(self):
+        self.commands.append('stop')
+
+    def pause(self):
+        self.commands.append('pause')
+
+    def seek(self, seconds):
+        self.commands.append('seek')
+
+    def skip_forward(self):
+        self.commands.append('skip_forward')
+
+    def skip_backward(self):
+        self.commands.append('skip_backward')
+
+    def get_volume(self):
+        return self.volume
+
+    def set_volume(self, volume):
+        self.commands.append('set_volume')
+        self.volume = volume
+
+
+def feed(controller, raw, now):
+    """
+    Poll the timers and consume one raw event (if any) at `now`.
+    :return: The list of NuimoEvent objects produced.
+    """
+    events = controller.poll_timers(now)
+    if raw is not None:
+        event = controller.consume_raw_event(RawNuimoEvent(raw), now)
+        if event is not None:
+            events.append(event)
+    return events
+
+
+def actions(events):
+    return [(event.action, event.timestamp) for event in events]
+
+
+def check_click_is_held_back():
+    c = NuimoController()
+    assert actions(feed(c, 'B,1', 0.0)) == [('button_press', 0.0)]
+    assert feed(c, 'B,0', 0.1) == []
+    assert abs(c.next_timeout(0.1) - c.DOUBLE_CLICK_TIMEOUT) < 1e-9
+    assert feed(c, None, 0.1 + c.DOUBLE_CLICK_TIMEOUT - 0.01) == []
+    events = feed(c, None, 0.1 + c.DOUBLE_CLICK_TIMEOUT)
+    # the click keeps the time of the release
+    assert actions(events) == [('button_release', 0.1)]
+    assert events[0].button_exclusive is True
+    assert c.next_timeout(1.0) is None
+
+
+def check_double_click():
+    c = NuimoController()
+    feed(c, 'B,1', 0.0)
+    feed(c, 'B,0', 0.1)
+    feed(c, 'B,1', 0.2)
+    assert actions(feed(c, 'B,0', 0.3)) == [('double_click', 0.3)]
+    # no single click follows once the window has passed
+    assert feed(c, None, 1.0) == []
+
+
+def check_clicks_outside_window():
+    c = NuimoController()
+    feed(c, 'B,1', 0.0)
+    feed(c, 'B,0', 0.1)
+    assert actions(feed(c, 'B,1', 0.5)) == [('button_release', 0.1), ('button_press', 0.5)]
+    assert feed(c, 'B,0', 0.6) == []
+    assert actions(feed(c, None, 1.0)) == [('button_release', 0.6)]
+
+
+def check_long_press():
+    c = NuimoController()
+    feed(c, 'B,1', 0.0)
+    assert feed(c, None, c.LONG_PRESS_TIMEOUT - 0.01) == []
+    # fires at the exact deadline, even when polled late
+    assert actions(feed(c, None, 2.0)) == [('long_press', c.LONG_PRESS_TIMEOUT)]
+    events = feed(c, 'B,0', 2.1)
+    assert actions(events) == [('button_release', 2.1)]
+    assert events[0].button_exclusive is False
+
+
+def check_long_press_cancelled_by_rotation():
+    c = NuimoController()
+    feed(c, 'B,1', 0.0)
+    assert feed(c, 'R,20', 0.3)[0].button_pressed is True
+    assert actions(feed(c, None, 0.3 + c.ROTATE_END_TIMEOUT)) == [('rotate_end', 0.3 + c.ROTATE_END_TIMEOUT)]
+    assert feed(c, None, 5.0) == []
+    assert feed(c, 'B,0', 5.1)[0].button_exclusive is False
+
+
+def check_stale_timers_are_discarded():
+    c = NuimoController()
+    for i in range(100):
+        feed(c, 'R,10', i * 0.01)
+    # every rotation re-armed rotate_end, the superseded entries are discarded once they surface
+    assert len(c._timer_heap) <= 2
+    assert abs(c.next_timeout(0.99) - c.ROTATE_END_TIMEOUT) < 1e-9
+    assert len(c._timer_heap) == 1
+    assert actions(feed(c, None, 2.0)) == [('rotate_end', 0.99 + c.ROTATE_END_TIMEOUT)]
+    assert c.next_timeout(2.0) is None
+
+
+def check_rotation_velocity():
+    c = NuimoController()
+    assert feed(c, 'R,10', 0.0)[0].rotate_velocity == 0.0
+    assert abs(feed(c, 'R,10', 0.1)[0].rotate_velocity - 100.0) < 1e-6
+    for i in range(2, 20):
+        event = feed(c, 'R,50', i * 0.1)[0]
+    # only the last ROTATE_VELOCITY_WINDOW samples count
+    assert len(c._rotation_samples) == c.ROTATE_VELOCITY_WINDOW
+    assert abs(event.rotate_velocity - 500.0) < 1e-6
+    feed(c, None, 10.0)
+    assert feed(c, 'R,10', 10.0)[0].rotate_velocity == 0.0
+
+
+def check_hold_and_seek_does_not_stop():
+    c = NuimoController()
+    player = RecordingPlayerController()
+    vlc = NuimoVLCController(player)
+    for raw, now in (('B,1', 0.0), (None, 1.0), ('R,20', 1.0), ('B,0', 1.2)):
+        for event in feed(c, raw, now):
+            vlc.consume_nuimo_event(event)
+    assert player.commands == ['seek']
+
+    player.commands = []
+    glyph = None
+    for raw, now in (('B,1', 2.0), (None, 3.0), ('B,0', 3.2)):
+        for event in feed(c, raw, now):
+            glyph = vlc.consume_nuimo_event(event)
+    assert player.commands == ['stop']
+    assert glyph.get_string() == glyph.STOP
+
+
+if __name__ == '__main__':
+    for check in (check_click_is_held_back, check_double_click, check_clicks_outside_window,
+                  check_long_press, check_long_press_cancelled_by_rotation,
+                  check_stale_timers_are_discarded, check_rotation_velocity,
+                  check_hold_and_seek_does_not_stop):
+        check()
+        print('{}: ok'.format(check.__name__))
@@ -5,11 +5,18 @@ and sending commands to VLC over Telnet.
 """
 from __future__ import absolute_import, unicode_literals
 
+import collections
+import heapq
+import itertools
+import logging
 import re
 import telnetlib
 import math
+import time
 #from PIL import Image, ImageFont, ImageDraw
 
+log = logging.getLogger(__name__)
+
 
 class RawNuimoEvent(object):
     """
@@ -65,10 +72,11 @@ class NuimoEvent(object):
     to determine whether the button is down when the wheel is being rotated, for example.
 
     """
-    ACTIONS = ('button_press', 'button_release', 'rotate', 'swipe')
+    ACTIONS = ('button_press', 'button_release', 'rotate', 'swipe',
+               'long_press', 'double_click', 'rotate_end')
 
     def __init__(self, action=None, button_pressed=False, button_exclusive=True,
-                 rotate_delta=None, swipe_direction=None):
+                 rotate_delta=None, rotate_velocity=None, swipe_direction=None, timestamp=None):
         if action not in self.ACTIONS:
             raise ValueError('action {} is not supported.'.format(action))
         self.action = action
@@ -77,7 +85,11 @@ class NuimoEvent(object):
         # during button press.
         self.button_exclusive = button_exclusive
         self.rotate_delta = rotate_delta
+        # Rotation speed in ticks per second, averaged over the most recent rotate events.
+        self.rotate_velocity = rotate_velocity
         self.swipe_direction = swipe_direction
+        # Time the event happened at. For synthesized events this is the exact timer deadline.
+        self.timestamp = timestamp
         super(NuimoEvent, self).__init__()
 
 
@@ -219,47 +231,170 @@ class NuimoController(object):
     A high-level abstraction for the Nuimo controller. Consumes RawNuimoEvent objects, updates internal
     state, and returns NuimoEvent objects representing updated state.
 
+    Time based gestures are driven by a heap of timer deadlines. The owner of the controller waits
+    at most next_timeout() seconds for the next raw event and calls poll_timers() afterwards, which
+    returns the synthesized 'long_press' and 'rotate_end' events, and the clicks held back for the
+    double click window, whose deadlines have passed.
+
     """
-    def __init__(self):
+    # seconds the button has to be held down for a 'long_press'
+    LONG_PRESS_TIMEOUT = 0.8
+    # maximum seconds between two exclusive button releases for a 'double_click'
+    DOUBLE_CLICK_TIMEOUT = 0.35
+    # seconds without rotation after which a 'rotate_end' is emitted
+    ROTATE_END_TIMEOUT = 0.5
+    # number of rotate events the rotation velocity is averaged over
+    ROTATE_VELOCITY_WINDOW = 8
+
+    def __init__(self, clock=time.time):
+        """
+        :param clock: A function returning the current time in seconds, used when no
+        explicit time is passed to the methods below.
+        :return:
+        """
+        self.clock = clock
         self.states = {
             'button_pressed': False,
             'button_press_exclusive': True,
+            # release time of a click which is held back until the double click window has passed
+            'click_time': None,
         }
+        # heap of (deadline, sequence, timer name). Timers are cancelled or re-armed by updating
+        # _timer_deadlines, heap entries which no longer match it are discarded when they surface.
+        self._timer_heap = []
+        self._timer_deadlines = {}
+        self._timer_sequence = itertools.count()
+        # ring buffer of (timestamp, delta) for the most recent rotate events
+        self._rotation_samples = collections.deque(maxlen=self.ROTATE_VELOCITY_WINDOW)
         super(NuimoController, self).__init__()
 
-    def consume_raw_event(self, raw_event):
+    def _set_timer(self, name, deadline):
+        self._timer_deadlines[name] = deadline
+        heapq.heappush(self._timer_heap, (deadline, next(self._timer_sequence), name))
+
+    def _cancel_timer(self, name):
+        self._timer_deadlines.pop(name, None)
+
+    def _discard_stale_timers(self):
+        while self._timer_heap:
+            deadline, _, name = self._timer_heap[0]
+            if self._timer_deadlines.get(name) == deadline:
+                break
+            heapq.heappop(self._timer_heap)
+
+    def _rotate_velocity(self):
+        """
+        Return the rotation speed in ticks per second over the samples in the ring buffer.
+        """
+        if len(self._rotation_samples) < 2:
+            return 0.0
+        elapsed = self._rotation_samples[-1][0] - self._rotation_samples[0][0]
+        if elapsed <= 0:
+            return 0.0
+        # the first sample only marks the start of the window
+        ticks = sum(abs(delta) for _, delta in itertools.islice(self._rotation_samples, 1, None))
+        return ticks / elapsed
+
+    def next_timeout(self, now=None):
+        """
+        Return the number of seconds until the next timer expires.
+        :param now: The current time, defaults to clock().
+        :return: A number of seconds >= 0, or None if no timer is pending.
+        """
+        self._discard_stale_timers()
+        if not self._timer_heap:
+            return None
+        if now is None:
+            now = self.clock()
+        return max(0.0, self._timer_heap[0][0] - now)
+
+    def poll_timers(self, now=None):
+        """
+        Expire all timers whose deadline has passed.
+        :param now: The current time, defaults to clock().
+        :return: A list of synthesized NuimoEvent objects, in deadline order.
+        """
+        if now is None:
+            now = self.clock()
+        events = []
+        self._discard_stale_timers()
+        while self._timer_heap and self._timer_heap[0][0] <= now:
+            deadline, _, name = heapq.heappop(self._timer_heap)
+            del self._timer_deadlines[name]
+            if name == 'click':
+                # no second click within the double click window
+                events.append(NuimoEvent(action='button_release', button_pressed=False,
+                                         button_exclusive=True, timestamp=self.states['click_time']))
+                self.states['click_time'] = None
+            elif name == 'long_press':
+                # the following release must not be treated as a click
+                self.states['button_press_exclusive'] = False
+                events.append(NuimoEvent(action='long_press', button_pressed=True, timestamp=deadline))
+            elif name == 'rotate_end':
+                self._rotation_samples.clear()
+                events.append(NuimoEvent(
+                    action='rotate_end',
+                    button_pressed=self.states['button_pressed'],
+                    timestamp=deadline
+                ))
+            self._discard_stale_timers()
+        return events
+
+    def consume_raw_event(self, raw_event, now=None):
         """
         Consume a RawNuimoEvent object, update internal state, and return a
         NuimoEvent object which represents the updated internal state.
+        An exclusive button release is held back for DOUBLE_CLICK_TIMEOUT: poll_timers() returns it
+        as 'button_release' if no second click follows, otherwise this method returns 'double_click'.
+        Call poll_timers() before this method so expired timers are handled first.
         :param raw_event: The incoming RawNuimoEvent.
-        :return: A NuimoEvent object which represents the updated internal state.
+        :param now: The time the event was received at, defaults to clock().
+        :return: A NuimoEvent object which represents the updated internal state, or None
+        if the event is held back.
         """
+        if now is None:
+            now = self.clock()
+
         if raw_event.action == 'B':
             # Button press/release
             if raw_event.value == '1':
                 self.states['button_pressed'] = True
                 self.states['button_press_exclusive'] = True
-                event = NuimoEvent(action='button_press', button_pressed=True)
+                self._set_timer('long_press', now + self.LONG_PRESS_TIMEOUT)
+                event = NuimoEvent(action='button_press', button_pressed=True, timestamp=now)
             else:
                 self.states['button_pressed'] = False
-                event = NuimoEvent(
-                    action='button_release',
-                    button_pressed=False,
-                    button_exclusive=self.states['button_press_exclusive']
-                )
+                self._cancel_timer('long_press')
+                if not self.states['button_press_exclusive']:
+                    event = NuimoEvent(action='button_release', button_pressed=False,
+                                       button_exclusive=False, timestamp=now)
+                elif 'click' in self._timer_deadlines:
+                    self._cancel_timer('click')
+                    self.states['click_time'] = None
+                    event = NuimoEvent(action='double_click', button_pressed=False, timestamp=now)
+                else:
+                    self.states['click_time'] = now
+                    self._set_timer('click', now + self.DOUBLE_CLICK_TIMEOUT)
+                    event = None
 
         elif raw_event.action == 'R':
             # Rotation
             self.states['button_press_exclusive'] = False
+            self._cancel_timer('long_press')
+            rotate_delta = int(raw_event.value)
+            self._rotation_samples.append((now, rotate_delta))
+            self._set_timer('rotate_end', now + self.ROTATE_END_TIMEOUT)
             event = NuimoEvent(
                 action='rotate',
-                rotate_delta=int(raw_event.value),
-                button_pressed=self.states['button_pressed']
+                rotate_delta=rotate_delta,
+                rotate_velocity=self._rotate_velocity(),
+                button_pressed=self.states['button_pressed'],
+                timestamp=now
             )
 
         elif raw_event.action == 'S':
             # Swipe
-            event = NuimoEvent(action='swipe', swipe_direction=raw_event.value)
+            event = NuimoEvent(action='swipe', swipe_direction=raw_event.value, timestamp=now)
         else:
             raise ValueError('unsupported event consumed: {}'.format(raw_event.action))
         return event
@@ -339,11 +474,11 @@ class TelnetVLCController(MediaPlayerController):
         self.connection = telnetlib.Telnet('localhost', 4212)
         self.connection.read_until('Password: ')
         self.connection.write(b'secret\n')
-        print self.connection.read_until('>')
+        log.debug('VLC banner: %s', self.connection.read_until('>'))
         super(TelnetVLCController, self).__init__()
 
     def _send_command(self, cmd):
-        print('send_command: ', cmd)
+        log.debug('send_command: %r', cmd)
         self.connection.write(cmd)
         return self.connection.read_until('>')
 
@@ -379,16 +514,28 @@ class NuimoVLCController(object):
     """
     A stateful media controller object.
     """
+    # rotation speed in ticks per second above which seek and volume steps are scaled up
+    ROTATE_REFERENCE_VELOCITY = 500.0
+    # maximum factor seek and volume steps are scaled by
+    ROTATE_MAX_SCALE = 4.0
+
     def __init__(self, player_interface):
         self.player_interface = player_interface
 
         self.player_states = {
-            'playing': False
+            'playing': False,
+            # set by a long press, playback stops when the button is released without rotating
+            'stop_on_release': False,
         }
         super(NuimoVLCController, self).__init__()
 
     def _button_release(self, event):
-        if event.button_exclusive is not False:
+        if self.player_states['stop_on_release']:
+            self.player_states['stop_on_release'] = False
+            self.player_interface.stop()
+            self.player_states['playing'] = False
+            return NuimoGlyph(symbol='STOP')
+        elif event.button_exclusive is not False:
             if self.player_states['playing'] is False:
                 self.player_interface.play()
                 self.player_states['playing'] = True
@@ -401,10 +548,22 @@ class NuimoVLCController(object):
             # clear display from whatever alternate mode was active
             return NuimoGlyph()
 
+    def _rotate_scale(self, event):
+        """
+        Return the factor to scale a rotation step by, based on the rotation speed. Fast rotation
+        covers a larger range with the same hand motion and thus fewer commands to the player.
+        """
+        if not event.rotate_velocity:
+            return 1.0
+        return min(self.ROTATE_MAX_SCALE, max(1.0, event.rotate_velocity / self.ROTATE_REFERENCE_VELOCITY))
+
     def _rotate(self, event):
+        # holding the button was the start of a seek, not a request to stop
+        self.player_states['stop_on_release'] = False
+        scale = self._rotate_scale(event)
         if event.button_pressed:
             # seek forward and back
-            scaled_delta = event.rotate_delta / 500.0
+            scaled_delta = event.rotate_delta * scale / 500.0
             self.player_interface.seek(scaled_delta)
             if scaled_delta > 0:
                 return NuimoGlyph(symbol='SEEK_FORWARD')
@@ -412,7 +571,7 @@ class NuimoVLCController(object):
                 return NuimoGlyph(symbol='SEEK_REVERSE')
         else:
             # change volume
-            scaled_delta = abs(event.rotate_delta / 16.0)
+            scaled_delta = abs(event.rotate_delta * scale / 16.0)
             volume = self.player_interface.get_volume()
             if event.rotate_delta > 0:
                 volume += math.ceil(scaled_delta)
@@ -427,7 +586,7 @@ class NuimoVLCController(object):
 
     def _swipe(self, event):
             # swipe
-            print(event.swipe_direction)
+            log.debug('swipe: %s', event.swipe_direction)
             if event.swipe_direction == 'R':
                 self.player_interface.skip_forward()
                 self.player_states['playing'] = True
@@ -441,6 +600,16 @@ class NuimoVLCController(object):
                 self.player_states['playing'] = False
                 return NuimoGlyph(symbol='STOP')
 
+    def _long_press(self, event):
+        # the button may still be rotated to seek, so only announce the stop until it is released
+        self.player_states['stop_on_release'] = True
+        return NuimoGlyph(symbol='STOP')
+
+    def _double_click(self, event):
+        self.player_interface.skip_forward()
+        self.player_states['playing'] = True
+        return NuimoGlyph(symbol='SKIP_FORWARD')
+
     def consume_nuimo_event(self, event):
         """
         Consume a NuimoEvent object and perform the necessary control actions in the media player.
@@ -453,6 +622,13 @@ class NuimoVLCController(object):
             glyph = self._rotate(event)
         elif event.action == 'swipe':
             glyph = self._swipe(event)
+        elif event.action == 'long_press':
+            glyph = self._long_press(event)
+        elif event.action == 'double_click':
+            glyph = self._double_click(event)
+        elif event.action == 'rotate_end':
+            # clear the seek/volume display once the wheel has come to rest
+            glyph = NuimoGlyph()
         else:
             glyph = None
         return glyph
@@ -463,26 +639,49 @@ def run_interface():
     Main module entry point
     :return:
     """
-    from websocket import create_connection
+    from websocket import create_connection, WebSocketTimeoutException
+    from ring_logging import configure_logging
 
+    log_handler = configure_logging()
     ws = create_connection('ws://localhost:8086/')
     nuimo_controller = NuimoController()
     vlc_controller = NuimoVLCController(TelnetVLCController())
 
     try:
         while True:
-            raw_event = RawNuimoEvent(ws.recv())
-            print "Received '%s'" % raw_event
-            nevent = nuimo_controller.consume_raw_event(raw_event)
-            glyph = vlc_controller.consume_nuimo_event(nevent)
-            if glyph is not None:
-                ws.send(glyph.get_string())
+            # wait for the next frame no longer than until the next gesture timer expires
+            timeout = nuimo_controller.next_timeout()
+            ws.settimeout(None if timeout is None else max(timeout, 0.001))
+            try:
+                data = ws.recv()
+            except WebSocketTimeoutException:
+                data = None
+
+            now = time.time()
+            nevents = nuimo_controller.poll_timers(now)
+            if data is not None:
+                raw_event = RawNuimoEvent(data)
+                log.debug("Received '%s'", raw_event)
+                nevent = nuimo_controller.consume_raw_event(raw_event, now)
+                if nevent is not None:
+                    nevents.append(nevent)
+
+            for nevent in nevents:
+                glyph = vlc_controller.consume_nuimo_event(nevent)
+                if glyph is not None:
+                    ws.send(glyph.get_string())
 
     except KeyboardInterrupt:
         pass
 
+    except Exception:
+        log.exception('Error while processing Nuimo events')
+        log_handler.dump_history()
+        raise
+
     finally:
         ws.close()
+        log_handler.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+"""
+Measures the per-event cost of the Nuimo event path in interface_telnet with logging off, with
+synchronous logging to a stream and with the ring buffered logging from ring_logging.
+
+The stream sleeps on every write to simulate stdout piped to a slow consumer.
+
+ e.g. python logging-benchmark.py 20000
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import sys
+import time
+
+from interface_telnet import MediaPlayerController, NuimoController, NuimoVLCController, RawNuimoEvent
+from ring_logging import LOG_FORMAT, RingBufferHandler
+
+RAW_EVENTS = ('B,1', 'B,0', 'R,12', 'R,-7', 'S,R', 'S,L', 'S,D', 'B,1', 'R,30', 'B,0')
+# simulated seconds between two raw events, so clicks are emitted and rotations end between gestures
+EVENT_INTERVAL = 0.15
+
+
+class NullPlayerController(MediaPlayerController):
+    """
+    A media player which does nothing, so only the event path itself is measured.
+    """
+    volume = 50.0
+
+    def play(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def seek(self, seconds):
+        pass
+
+    def skip_forward(self):
+        pass
+
+    def skip_backward(self):
+        pass
+
+    def get_volume(self):
+        return self.volume
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+
+class SlowStream(object):
+    """
+    A file-like object which blocks for `delay` seconds on every write.
+    """
+    def __init__(self, delay):
+        self.delay = delay
+
+    def write(self, data):
+        time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+def run_events(count):
+    nuimo_controller = NuimoController()
+    vlc_controller = NuimoVLCController(NullPlayerController())
+    log = logging.getLogger('interface_telnet')
+    start = time.time()
+    for i in range(count):
+        # drive the controller like run_interface does, on a simulated clock
+        now = i * EVENT_INTERVAL
+        nevents = nuimo_controller.poll_timers(now)
+        raw_event = RawNuimoEvent(RAW_EVENTS[i % len(RAW_EVENTS)])
+        log.debug("Received '%s'", raw_event)
+        nevent = nuimo_controller.consume_raw_event(raw_event, now)
+        if nevent is not None:
+            nevents.append(nevent)
+        for nevent in nevents:
+            vlc_controller.consume_nuimo_event(nevent)
+    return (time.time() - start) / count
+
+
+def benchmark(name, handler, count):
+    root = logging.getLogger()
+    root.handlers = []
+    if handler is None:
+        root.setLevel(logging.WARNING)
+    else:
+        root.setLevel(logging.DEBUG)
+        root.addHandler(handler)
+    per_event = run_events(count)
+    if handler is not None:
+        root.removeHandler(handler)
+        handler.close()
+    print('{:<24} {:8.2f} us/event'.format(name, per_event * 1e6))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    delay = 0.0001
+
+    benchmark('logging off', None, count)
+
+    sync_handler = logging.StreamHandler(SlowStream(delay))
+    sync_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    benchmark('synchronous stream', sync_handler, count)
+
+    target = logging.StreamHandler(SlowStream(delay))
+    target.setFormatter(logging.Formatter(LOG_FORMAT))
+    benchmark('ring buffer', RingBufferHandler(target, capacity=count), count)
+
+    target = logging.StreamHandler(SlowStream(delay))
+    target.setFormatter(logging.Formatter(LOG_FORMAT))
+    benchmark('ring buffer, debug', RingBufferHandler(target, capacity=count, debug=True), count)
+
+
+if __name__ == '__main__':
+    main()
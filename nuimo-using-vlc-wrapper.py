@@ -1,12 +1,24 @@
 from __future__ import absolute_import, unicode_literals
 
+import logging
 import re
 import soundcloud
 import os
+import threading
+import time
 import vlc
 from websocket import create_connection
 import sys
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ring_logging import configure_logging
+
+log = logging.getLogger(__name__)
+
 
 class NuimoEvent(object):
     """
@@ -52,45 +64,201 @@ class NuimoEvent(object):
         return self.raw_event
 
 
+class SoundCloudPlaylist(object):
+    """
+    The track ids of one resolved SoundCloud playlist and the playback position within it.
+    A playlist which could not be resolved has no tracks and the exception in `error`.
+    """
+
+    def __init__(self, permalink, track_ids, error=None):
+        self.permalink = permalink
+        self.track_ids = track_ids
+        self.error = error
+        self.current_track = 0
+
+
 class SoundCloudPlaylistVLCController(object):
     """
-    A high-level interface to the media player for one SoundCloud playlist using VLC
+    A high-level interface to the media player for a set of SoundCloud playlists using VLC.
+    The first playlist with tracks is resolved and started right away, the others are resolved by a
+    background worker which also prefetches the stream locations of the tracks likely played next
+    and keeps them fresh.
     """
+    # seconds a prefetched stream location is used for, SoundCloud signs them with an expiry
+    STREAM_LOCATION_MAX_AGE = 60
+    # seconds after which the background worker fetches a prefetched stream location again
+    STREAM_LOCATION_REFRESH_AGE = 30
 
-    def __init__(self, playlist_permalink):
-        self.permalink = playlist_permalink
+    def __init__(self, playlist_permalinks):
+        self.permalinks = list(playlist_permalinks)
 
-        print 'Loading playlist {0}'.format(playlist_permalink)
         client_id = os.getenv("CLIENT_ID")
         self.soundcloud_client = soundcloud.Client(client_id=client_id)
 
-        playlist_id = self.soundcloud_client.get('/resolve', url=playlist_permalink).__getattr__("id")
-        playlist_resource = self.soundcloud_client.get('/playlists/' + str(playlist_id))
-        track_list = []
-        for track in playlist_resource.__getattr__("tracks"):
-            track_list.append(track['id'])
-        self.playlist = track_list
+        # None until the playlist at that index has been resolved
+        self.playlists = [None] * len(self.permalinks)
+        self.current_playlist = 0
+        # prefetched (fetch time, stream location) by track id, each one is used at most once
+        self._stream_locations = {}
+        # track ids reachable with a single gesture, their stream locations are kept fresh
+        self._prefetch_track_ids = frozenset()
+        # stream urls by track id, unlike the locations they redirect to these do not expire
+        self._stream_urls = {}
+        self._background_jobs = queue.Queue()
 
         self.player_instance = vlc.Instance()
         self.media_player = self.player_instance.media_player_new()
 
-        self.current_track = 0
+        for index in range(len(self.permalinks)):
+            playlist = self._load_playlist(index)
+            if playlist.track_ids:
+                break
+        else:
+            raise ValueError('none of the playlists {} could be loaded or has tracks'.format(
+                ', '.join(self.permalinks)))
+        self.current_playlist = index
         self.play_track_from_list(0)
 
+        worker = threading.Thread(target=self._background_worker, name='playlist-resolver')
+        worker.daemon = True
+        worker.start()
+        for index in range(self.current_playlist + 1, len(self.permalinks)):
+            self._background_jobs.put((self._load_background_playlist, index))
+
         super(SoundCloudPlaylistVLCController, self).__init__()
 
+    @property
+    def playlist(self):
+        return self.playlists[self.current_playlist]
+
+    @property
+    def current_track(self):
+        return self.playlist.current_track
+
+    def _background_worker(self):
+        while True:
+            try:
+                job, argument = self._background_jobs.get(timeout=self.STREAM_LOCATION_REFRESH_AGE / 2.0)
+            except queue.Empty:
+                job, argument = self._refresh_stream_locations, None
+            try:
+                job(argument)
+            except Exception:
+                log.exception('Background job %s(%s) failed', job.__name__, argument)
+
+    def _resolve_playlist(self, permalink):
+        log.info('Loading playlist %s', permalink)
+        playlist_id = self.soundcloud_client.get('/resolve', url=permalink).__getattr__("id")
+        playlist_resource = self.soundcloud_client.get('/playlists/' + str(playlist_id))
+        track_list = []
+        for track in playlist_resource.__getattr__("tracks"):
+            track_list.append(track['id'])
+        return SoundCloudPlaylist(permalink, track_list)
+
+    def _load_playlist(self, index):
+        try:
+            playlist = self._resolve_playlist(self.permalinks[index])
+        except Exception as e:
+            log.exception('Could not load playlist %s', self.permalinks[index])
+            playlist = SoundCloudPlaylist(self.permalinks[index], [], error=e)
+        else:
+            if not playlist.track_ids:
+                log.warning('Playlist %s is empty', playlist.permalink)
+        self.playlists[index] = playlist
+        return playlist
+
+    def _load_background_playlist(self, index):
+        self._load_playlist(index)
+        # the new playlist may be a neighbour of the current one
+        self._schedule_prefetches()
+
+    def _get_stream_location(self, soundcloud_track_id):
+        stream_url = self._stream_urls.get(soundcloud_track_id)
+        if stream_url is None:
+            track = self.soundcloud_client.get('/tracks/{0}'.format(soundcloud_track_id), allow_redirects=False)
+            stream_url = self._stream_urls[soundcloud_track_id] = track.stream_url
+        return self.soundcloud_client.get(stream_url, allow_redirects=False).location
+
+    def _is_fresh(self, prefetched):
+        return prefetched is not None and time.time() - prefetched[0] < self.STREAM_LOCATION_MAX_AGE
+
+    def _prefetch_stream_location(self, soundcloud_track_id):
+        prefetched = self._stream_locations.get(soundcloud_track_id)
+        if prefetched is None or time.time() - prefetched[0] >= self.STREAM_LOCATION_REFRESH_AGE:
+            fetch_time = time.time()
+            stream_location = self._get_stream_location(soundcloud_track_id)
+            self._stream_locations[soundcloud_track_id] = (fetch_time, stream_location)
+
+    def _refresh_stream_locations(self, _=None):
+        """
+        Drop stream locations which are no longer reachable with a single gesture and
+        fetch the others again before they expire.
+        """
+        prefetch_track_ids = self._prefetch_track_ids
+        for soundcloud_track_id in list(self._stream_locations):
+            if soundcloud_track_id not in prefetch_track_ids:
+                self._stream_locations.pop(soundcloud_track_id, None)
+        for soundcloud_track_id in prefetch_track_ids:
+            self._prefetch_stream_location(soundcloud_track_id)
+
+    def _schedule_prefetches(self):
+        """
+        Prefetch the next track of the current playlist and the current tracks of the
+        neighbouring playlists, i.e. everything reachable with a single swipe.
+        """
+        candidates = [(self.playlist, self.current_track + 1)]
+        if len(self.playlists) > 1:
+            for step in (-1, 1):
+                index = (self.current_playlist + step) % len(self.playlists)
+                neighbour = self.playlists[index]
+                if neighbour is not None and index != self.current_playlist:
+                    candidates.append((neighbour, neighbour.current_track))
+        track_ids = [playlist.track_ids[track_number] for playlist, track_number in candidates
+                     if 0 <= track_number < len(playlist.track_ids)]
+        self._prefetch_track_ids = frozenset(track_ids)
+        for soundcloud_track_id in track_ids:
+            self._background_jobs.put((self._prefetch_stream_location, soundcloud_track_id))
+
     def play_track_from_list(self, track_number):
-        soundcloud_track_id = self.playlist[track_number]
-        print 'Playing track number {0} with id {1}'.format(track_number, soundcloud_track_id)
+        soundcloud_track_id = self.playlist.track_ids[track_number]
+        log.info('Playing track number %d with id %s', track_number, soundcloud_track_id)
 
-        self.current_track = track_number
-        track = self.soundcloud_client.get('/tracks/{0}'.format(soundcloud_track_id), allow_redirects=False)
-        stream_url = self.soundcloud_client.get(track.stream_url, allow_redirects=False)
-        stream_location = stream_url.location
+        self.playlist.current_track = track_number
+        prefetched = self._stream_locations.pop(soundcloud_track_id, None)
+        if self._is_fresh(prefetched):
+            stream_location = prefetched[1]
+        else:
+            stream_location = self._get_stream_location(soundcloud_track_id)
 
         media = self.player_instance.media_new(stream_location)
         self.media_player.set_media(media)
         self.media_player.play()
+        self._schedule_prefetches()
+
+    def switch_playlist(self, step):
+        """
+        Move the playlist cursor by `step` (wrapping around) and resume the playlist
+        at the track it was left at. Empty playlists and ones that failed to load are skipped.
+        :param step: 1 to switch to the next playlist, -1 for the previous one.
+        :return:
+        """
+        index = self.current_playlist
+        for _ in range(len(self.playlists) - 1):
+            index = (index + step) % len(self.playlists)
+            playlist = self.playlists[index]
+            if playlist is None:
+                log.info('Playlist %s is still loading', self.permalinks[index])
+                return
+            elif playlist.error is not None:
+                log.warning('Skipping playlist %s, it failed to load: %s', playlist.permalink, playlist.error)
+            elif not playlist.track_ids:
+                log.warning('Skipping empty playlist %s', playlist.permalink)
+            else:
+                log.info('Switching to playlist %s', playlist.permalink)
+                self.current_playlist = index
+                self.play_track_from_list(playlist.current_track)
+                return
+        log.info('No other playlist to switch to')
 
     def pause(self):
         self.media_player.pause()
@@ -108,7 +276,7 @@ class SoundCloudPlaylistVLCController(object):
 
     def change_volume(self, percentage_delta):
         percentage = min(100, percentage_delta) if percentage_delta > 0 else max(-100, percentage_delta)
-        print 'Changing volume by {0}%'.format(percentage)
+        log.debug('Changing volume by %d%%', percentage)
         current_volume = self.media_player.audio_get_volume()
         self.media_player.audio_set_volume(current_volume + percentage)
 
@@ -131,22 +299,28 @@ class Dispatcher(object):
     def swipe(self, direction):
         if direction == 'R':
             self.player.skip_to_next_track()
-        else:
+        elif direction == 'L':
             self.player.skip_to_previous_track()
+        elif direction == 'U':
+            self.player.switch_playlist(1)
+        elif direction == 'D':
+            self.player.switch_playlist(-1)
 
 def run_interface():
     """
     Main module entry point,
-    run with the permalink of the playlist you want to control as command line argument
+    run with the permalinks of the playlists you want to control as command line arguments,
+    swipe up/down to switch between them
     requires the environment variables CLIENT_ID and VLC_PLUGIN_PATH
 
-     e.g. VLC_PLUGIN_PATH=/Applications/VLC.app/Contents/MacOS/ CLIENT_ID=123abc python nuimo-using-vlc-wrapper.py https://soucloud.com/forss/sets/ecclesia
+     e.g. VLC_PLUGIN_PATH=/Applications/VLC.app/Contents/MacOS/ CLIENT_ID=123abc python nuimo-using-vlc-wrapper.py https://soucloud.com/forss/sets/ecclesia https://soundcloud.com/forss/sets/flickermood
     :return:
     """
+    log_handler = configure_logging()
     ws = create_connection('ws://localhost:8086/')
 
-    playlist_permalink = sys.argv[1]
-    player = SoundCloudPlaylistVLCController(playlist_permalink)
+    playlist_permalinks = sys.argv[1:]
+    player = SoundCloudPlaylistVLCController(playlist_permalinks)
 
     dispatcher = Dispatcher(player)
 
@@ -154,7 +328,7 @@ def run_interface():
     try:
         while True:
             event = NuimoEvent(ws.recv())
-            print(event.verb, event.value)
+            log.debug('event: %s %s', event.verb, event.value)
 
             if event.verb == 'B' and event.value == '0':
                 dispatcher.button_pressed()
@@ -166,8 +340,14 @@ def run_interface():
     except KeyboardInterrupt:
         pass
 
+    except Exception:
+        log.exception('Error while processing Nuimo events')
+        log_handler.dump_history()
+        raise
+
     finally:
         ws.close()
+        log_handler.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,163 @@
+"""
+This file implements non-blocking logging for the Nuimo event loop. Records are appended to an
+in-memory ring buffer and written out by a background thread, so a slow stdout never stalls the
+processing of a Nuimo event.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import collections
+import logging
+import os
+import sys
+import threading
+
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    A logging handler which only appends records to a fixed-size ring buffer. A background thread
+    drains the buffer and passes the records on to a target handler. If the buffer fills up faster
+    than it is drained, the oldest records are dropped and the drain thread reports how many.
+
+    In debug mode the handler additionally keeps the most recent records below the target's level in
+    a history buffer. These are never written by the drain thread, but can be dumped with
+    dump_history(), e.g. when an error occurs.
+
+    """
+    def __init__(self, target, capacity=1024, debug=False, drain_interval=0.05):
+        """
+        :param target: The logging.Handler the buffered records are eventually written to.
+        :param capacity: The maximum number of records held by the ring buffer.
+        :param debug: If True, also keep the last `capacity` records the target does not write
+        for dump_history().
+        :param drain_interval: Time in seconds the drain thread sleeps when the buffer is empty.
+        :return:
+        """
+        logging.Handler.__init__(self)
+        self.target = target
+        self.drain_interval = drain_interval
+        self._buffer = collections.deque(maxlen=capacity)
+        self._history = collections.deque(maxlen=capacity) if debug else None
+        # number of records pushed out of the full buffer, guarded by the handler lock
+        self._dropped = 0
+        # serializes writes to the target between the drain thread and dump_history()
+        self._drain_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._drain_loop, name='ring-logging')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        """
+        Append a record to the ring buffer. Called in the hot path, so this does no formatting and
+        no I/O. logging.Handler.handle() already holds the handler lock here.
+        :param record: The logging.LogRecord to buffer.
+        :return:
+        """
+        if record.levelno < self.target.level:
+            # never written by the target, so only kept for dump_history()
+            if self._history is not None:
+                self._history.append(record)
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+        self._buffer.append(record)
+
+    def _report_dropped(self):
+        self.acquire()
+        try:
+            dropped, self._dropped = self._dropped, 0
+        finally:
+            self.release()
+        if dropped:
+            self.target.handle(logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': logging.getLevelName(logging.WARNING),
+                'msg': '%d log records dropped, ring buffer full',
+                'args': (dropped,),
+            }))
+
+    def _drain(self):
+        with self._drain_lock:
+            self._report_dropped()
+            while self._buffer:
+                try:
+                    record = self._buffer.popleft()
+                except IndexError:
+                    break
+                # emit() already filters on level, but the target's level may have been raised since
+                if record.levelno >= self.target.level:
+                    self.target.handle(record)
+
+    def _drain_loop(self):
+        while not self._stopped.is_set():
+            self._drain()
+            self._stopped.wait(self.drain_interval)
+        self._drain()
+
+    def flush(self):
+        """
+        Write out all buffered records from the calling thread.
+        :return:
+        """
+        self._drain()
+        self.target.flush()
+
+    def dump_history(self, stream=None):
+        """
+        Write out everything still buffered, followed by the recent records the target did not write
+        because of their level. Only available in debug mode.
+        :param stream: A file-like object, defaults to the target's stream or sys.stderr.
+        :return:
+        """
+        if self._history is None:
+            return
+        stream = stream or getattr(self.target, 'stream', None) or sys.stderr
+        self.flush()
+        with self._drain_lock:
+            records = list(self._history)
+            self._history.clear()
+            stream.write('--- last {} unwritten log records ---\n'.format(len(records)))
+            for record in records:
+                stream.write(self.target.format(record) + '\n')
+            stream.write('--- end of log records ---\n')
+            stream.flush()
+
+    def close(self):
+        """
+        Stop the drain thread after writing out everything still in the buffer.
+        :return:
+        """
+        self._stopped.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.target.flush()
+        logging.Handler.close(self)
+
+
+def configure_logging(debug=None, capacity=1024, stream=None):
+    """
+    Install a RingBufferHandler on the root logger.
+    :param debug: Enable debug mode, i.e. keep the most recent DEBUG level records in a history
+    buffer which can be dumped on error. Only INFO and above is written out as it happens.
+    Defaults to the NUIMO_DEBUG environment variable.
+    :param capacity: The ring buffer size in records.
+    :param stream: Where the records are eventually written to, defaults to sys.stderr.
+    :return: The installed RingBufferHandler.
+    """
+    if debug is None:
+        debug = bool(os.getenv('NUIMO_DEBUG'))
+    target = logging.StreamHandler(stream)
+    target.setFormatter(logging.Formatter(LOG_FORMAT))
+    target.setLevel(logging.INFO)
+    handler = RingBufferHandler(target, capacity=capacity, debug=debug)
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+    atexit.register(handler.close)
+    return handler